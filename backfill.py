@@ -0,0 +1,137 @@
+# Copyright 2020 Janne Määttä
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Backfill InfluxDB from saved cache snapshots
+"""
+import argparse
+import glob
+import json
+import logging
+from pathlib import Path
+import sys
+
+import pendulum
+
+from tojota import CACHE_DIR, INFLUXDB_BATCH_SIZE, ev_data_points, flush_influxdb_spool, odometer_points, \
+    trip_points, write_into_influxdb
+
+logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+def parse_args():
+    """
+    Parse command line arguments
+    :return: arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', required=False, dest='from_date', help='Backfill data beginning from date YYYY-MM-DD')
+    parser.add_argument('-b', required=False, dest='batch_size', type=int, default=INFLUXDB_BATCH_SIZE,
+                        help='Points per InfluxDB write')
+    args = parser.parse_args()
+    return args
+
+
+def load_snapshots(pattern):
+    """
+    Load JSON snapshots matching the pattern. Files that can't be parsed are skipped.
+    :param pattern: Path expression for cache files. Like 'cache/odometer/odometer*'
+    :return: generator of dicts
+    """
+    for file_path in glob.iglob(pattern):
+        try:
+            with open(file_path, encoding='utf-8') as f:
+                yield json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning('Skipping %s: %s', file_path, str(e))
+
+
+def odometer_lines(from_date=None):
+    """
+    Get influxdb lines from CACHE_DIR/odometer snapshots
+    :param from_date: Skip snapshots older than this pendulum datetime
+    :return: list of line protocol strings
+    """
+    lines = []
+    for snapshot in load_snapshots(str(Path(CACHE_DIR) / 'odometer' / 'odometer*')):
+        try:
+            data = snapshot['payload']
+            timestamp = data['timestamp']
+            if from_date and pendulum.parse(timestamp) < from_date:
+                continue
+            lines += odometer_points(data['fuelLevel'], data['odometer']['value'], timestamp)
+        except (KeyError, TypeError):
+            continue
+    return lines
+
+
+def remote_control_lines(from_date=None):
+    """
+    Get influxdb lines from CACHE_DIR/remote_control snapshots
+    :param from_date: Skip snapshots older than this pendulum datetime
+    :return: list of line protocol strings
+    """
+    lines = []
+    for snapshot in load_snapshots(str(Path(CACHE_DIR) / 'remote_control' / 'remote_control*')):
+        try:
+            data = snapshot['payload']
+            if from_date and pendulum.parse(data['lastUpdateTimestamp']) < from_date:
+                continue
+            lines += ev_data_points(data)
+        except (KeyError, TypeError):
+            continue
+    return lines
+
+
+def trip_lines(from_date=None):
+    """
+    Get influxdb lines from trips saved to CACHE_DIR/trips/[12]/[34]/uuid
+    :param from_date: Skip trips ended before this pendulum datetime
+    :return: list of line protocol strings
+    """
+    lines = []
+    for trip in load_snapshots(str(Path(CACHE_DIR) / 'trips' / '*' / '*' / '*')):
+        try:
+            timestamp = trip['summary']['endTs']
+            if from_date and pendulum.parse(timestamp) < from_date:
+                continue
+            lines += trip_points(trip['summary']['length'] / 1000, trip['summary']['fuelConsumption'] / 1000, timestamp)
+        except (KeyError, TypeError):
+            continue
+    return lines
+
+
+def main():
+    """
+    Replay saved odometer, remote control and trip snapshots into InfluxDB using their payload timestamps
+    :return:
+    """
+    args = parse_args()
+    from_date = pendulum.parse(args.from_date) if args.from_date else None
+
+    if not flush_influxdb_spool(args.batch_size):
+        log.error('InfluxDB is not accepting writes, try again later')
+        return 1
+
+    for name, get_lines in (('odometer', odometer_lines), ('remote control', remote_control_lines),
+                            ('trip', trip_lines)):
+        lines = get_lines(from_date)
+        log.info('Writing %s %s points...', len(lines), name)
+        write_into_influxdb(lines, args.batch_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# Copyright 2020 Janne Määttä
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Print charging sessions tracked from remote control status and telemetry snapshots
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+
+import pendulum
+
+from tojota import BATTERY_CAPACITY, CACHE_DIR, CHARGING_SESSIONS, ChargingSessionTracker, Myt
+
+logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+def parse_args():
+    """
+    Parse command line arguments
+    :return: arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', required=False, dest='from_date',
+                        help='Show sessions beginning from date YYYY-MM-DD, default is start of this month')
+    parser.add_argument('-t', required=False, dest='to_date', help='Show sessions before date YYYY-MM-DD')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Rebuild sessions from all saved remote control and odometer snapshots')
+    args = parser.parse_args()
+    return args
+
+
+def load_snapshots():
+    """
+    Load saved remote control and odometer snapshots as (timestamp, charging status, battery level, remaining charge
+    time, source) tuples
+    :return: list of tuples sorted by timestamp
+    """
+    snapshots = []
+    for file_path in glob.glob(str(Path(CACHE_DIR) / 'remote_control' / 'remote_control*')):
+        try:
+            with open(file_path, encoding='utf-8') as f:
+                data = json.load(f)['payload']
+            snapshots.append((pendulum.parse(data['lastUpdateTimestamp']), data['chargingStatus'],
+                              data['batteryLevel'], data.get('remainingChargeTime'),
+                              ChargingSessionTracker.REMOTE_CONTROL))
+        except (OSError, ValueError, KeyError, TypeError):
+            log.warning('Skipping %s', file_path)
+    for file_path in glob.glob(str(Path(CACHE_DIR) / 'odometer' / 'odometer*')):
+        try:
+            with open(file_path, encoding='utf-8') as f:
+                data = json.load(f)['payload']
+            snapshots.append((pendulum.parse(data['timestamp']), data['chargingStatus'], data['batteryLevel'], None,
+                              ChargingSessionTracker.TELEMETRY))
+        except (OSError, ValueError, KeyError, TypeError):
+            log.warning('Skipping %s', file_path)
+    return sorted(snapshots, key=lambda snapshot: snapshot[0])
+
+
+def rebuild(battery_capacity):
+    """
+    Replace saved charging sessions with sessions built from all saved snapshots
+    :param battery_capacity: Usable battery capacity in kWh
+    :return: ChargingSessionTracker
+    """
+    try:
+        os.remove(Path(CACHE_DIR) / CHARGING_SESSIONS)
+    except FileNotFoundError:
+        pass
+    tracker = ChargingSessionTracker(battery_capacity)
+    for timestamp, charging_status, battery_level, remaining_charge_time, source in load_snapshots():
+        tracker.process(str(timestamp), charging_status, battery_level, remaining_charge_time, source)
+    tracker.save()
+    return tracker
+
+
+def main():
+    """
+    Print charging sessions
+    :return:
+    """
+    args = parse_args()
+    config_data = Myt._get_config()  # pylint: disable=W0212
+    timezone = config_data['timezone']
+    battery_capacity = config_data.get('battery_capacity', BATTERY_CAPACITY)
+
+    if args.rebuild:
+        tracker = rebuild(battery_capacity)
+    else:
+        tracker = ChargingSessionTracker(battery_capacity)
+
+    from_date = pendulum.parse(args.from_date, tz=timezone) if args.from_date else pendulum.now(timezone).start_of('month')
+    to_date = pendulum.parse(args.to_date, tz=timezone) if args.to_date else None
+    total_energy = 0
+    for session in tracker.get_sessions(from_date, to_date):
+        total_energy += session['energy']
+        print('{} -> {}: battery {}% -> {}%, {:.2f} kWh, idle on plug {} min'.format(
+            pendulum.parse(session['start']).in_tz(timezone).to_datetime_string(),
+            pendulum.parse(session['end']).in_tz(timezone).to_datetime_string(),
+            session['start_level'], session['end_level'], session['energy'], session['idle_on_plug'] // 60))
+    if tracker.current:
+        print('Charging session in progress since {}, battery {}% -> {}%'.format(
+            pendulum.parse(tracker.current['start']).in_tz(timezone).to_datetime_string(),
+            tracker.current['start_level'], tracker.current['end_level']))
+    print('Total energy: {:.2f} kWh'.format(total_energy))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
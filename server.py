@@ -0,0 +1,309 @@
+# Copyright 2020 Janne Määttä
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Local HTTP server for cached vehicle state. Latest telemetry, parking, remote control status and trips are kept in
+memory and refreshed in the background using one Myt session.
+
+GET /<kind> returns latest data, GET /<kind>/history?from=YYYY-MM-DD&to=YYYY-MM-DD returns saved data within range in
+the same format. Kind is one of telemetry, parking, remote_control or trips.
+"""
+import argparse
+import bisect
+import glob
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import sys
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pendulum
+
+from tojota import CACHE_DIR, Myt, parse_telemetry
+
+logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s: %(message)s')
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# kind: (cache files, function to convert saved data to served format, function to get timestamp from served data)
+HISTORY_SOURCES = {
+    'telemetry': (Path('odometer') / 'odometer*', lambda data: parse_telemetry(data['payload']),
+                  lambda data: data['timestamp']),
+    'parking': (Path('parking') / 'parking*', lambda data: data, lambda data: data['payload']['lastTimestamp']),
+    'remote_control': (Path('remote_control') / 'remote_control*', lambda data: data,
+                       lambda data: data['payload']['lastUpdateTimestamp']),
+    'trips': (Path('trips') / '*' / '*' / '*', lambda data: data, lambda data: data['summary']['startTs']),
+}
+
+
+def parse_args():
+    """
+    Parse command line arguments
+    :return: arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', required=False, dest='address', default='127.0.0.1', help='Listen address')
+    parser.add_argument('-p', required=False, dest='port', type=int, default=8088, help='Listen port')
+    parser.add_argument('-i', required=False, dest='interval', type=int, default=600,
+                        help='Seconds between background refreshes')
+    args = parser.parse_args()
+    return args
+
+
+class History:
+    """
+    Saved data items sorted by timestamp
+    """
+    def __init__(self):
+        self.timestamps = []
+        self.items = []
+        self.lock = threading.Lock()
+
+    def add(self, timestamp, item):
+        """
+        Add item to history
+        :param timestamp: ISO 8601 timestamp of the item
+        :param item: data dict
+        :return: None
+        """
+        timestamp = pendulum.parse(timestamp).timestamp()
+        with self.lock:
+            i = bisect.bisect_right(self.timestamps, timestamp)
+            if i and self.timestamps[i - 1] == timestamp and self.items[i - 1] == item:
+                return
+            self.timestamps.insert(i, timestamp)
+            self.items.insert(i, item)
+
+    def between(self, from_date=None, to_date=None):
+        """
+        Get items within range
+        :param from_date: pendulum datetime or None
+        :param to_date: pendulum datetime or None, exclusive
+        :return: list of data dicts
+        """
+        with self.lock:
+            start = bisect.bisect_left(self.timestamps, from_date.timestamp()) if from_date else 0
+            end = bisect.bisect_left(self.timestamps, to_date.timestamp()) if to_date else len(self.timestamps)
+            return self.items[start:end]
+
+
+class VehicleState:
+    """
+    Latest vehicle data as encoded JSON and history of saved data
+    """
+    def __init__(self):
+        self.latest = {}
+        self.history = {kind: History() for kind in HISTORY_SOURCES}
+
+    def _set_latest(self, kind, data):
+        """
+        Encode data once so that reads don't have to
+        :param kind: Data kind, key of HISTORY_SOURCES
+        :param data: data dict
+        :return: None
+        """
+        self.latest[kind] = json.dumps(data).encode('utf-8')
+
+    def _add_history(self, kind, data):
+        """
+        Add served format data to history
+        :param kind: Data kind, key of HISTORY_SOURCES
+        :param data: data dict
+        :return: None
+        """
+        self.history[kind].add(HISTORY_SOURCES[kind][2](data), data)
+
+    def load_cache(self):
+        """
+        Load history from CACHE_DIR and set latest data from the newest saved data
+        :return: None
+        """
+        for kind, (pattern, convert, _) in HISTORY_SOURCES.items():
+            for file_path in glob.iglob(str(Path(CACHE_DIR) / pattern)):
+                try:
+                    with open(file_path, encoding='utf-8') as f:
+                        self._add_history(kind, convert(json.load(f)))
+                except (OSError, ValueError, KeyError, TypeError):
+                    continue
+            log.info('Loaded %s %s items', len(self.history[kind].items), kind)
+
+        for kind in ('telemetry', 'parking', 'remote_control'):
+            if self.history[kind].items:
+                self._set_latest(kind, self.history[kind].items[-1])
+        latest_trips = Myt._find_latest_file(str(Path(CACHE_DIR) / 'trips' / 'trips*'))  # pylint: disable=W0212
+        if latest_trips:
+            with open(latest_trips, encoding='utf-8') as f:
+                self.latest['trips'] = f.read().encode('utf-8')
+
+    def refresh(self, myt):
+        """
+        Fetch fresh data from MyT API. Failing requests are logged and previous data is kept.
+        :param myt: Myt object
+        :return: None
+        """
+        try:
+            parking, fresh = myt.get_parking()
+            self._set_latest('parking', parking)
+            if fresh:
+                self._add_history('parking', parking)
+        except (ValueError, KeyError) as e:
+            log.warning('Failed to refresh parking: %s', str(e))
+
+        try:
+            telemetry, fresh = myt.get_telemetry()
+            self._set_latest('telemetry', telemetry)
+            if fresh:
+                self._add_history('telemetry', telemetry)
+        except (ValueError, KeyError) as e:
+            log.warning('Failed to refresh telemetry: %s', str(e))
+
+        if myt.config_data['use_remote_control']:
+            try:
+                status, fresh = myt.get_remote_control_status()
+                self._set_latest('remote_control', status)
+                if fresh:
+                    self._add_history('remote_control', status)
+            except (ValueError, KeyError) as e:
+                log.warning('Failed to refresh remote control status: %s', str(e))
+
+        try:
+            trips, _ = myt.get_trips()
+            self._set_latest('trips', trips)
+            for trip in trips['payload']['trips']:
+                trip_data, fresh = myt.get_trip(trips['payload']['trips'], trip['id'])
+                if fresh:
+                    self._add_history('trips', trip_data)
+        except (ValueError, KeyError) as e:
+            log.warning('Failed to refresh trips: %s', str(e))
+
+
+def refresh_loop(state, myt, interval, stop):
+    """
+    Refresh state every interval seconds until stop is set
+    :param state: VehicleState
+    :param myt: Myt object
+    :param interval: Seconds between refreshes
+    :param stop: threading.Event
+    :return: None
+    """
+    while not stop.is_set():
+        try:
+            myt.refresh_login()
+            state.refresh(myt)
+        except Exception as e:  # pylint: disable=W0703
+            log.error('Refresh failed! %s', str(e))
+        stop.wait(interval)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve latest data and history from VehicleState
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body):
+        """
+        Send JSON response
+        :param status: HTTP status code
+        :param body: Encoded JSON
+        :return: None
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        """
+        Send JSON error response
+        :param status: HTTP status code
+        :param message: Error message
+        :return: None
+        """
+        self._send(status, json.dumps({'error': message}).encode('utf-8'))
+
+    def do_GET(self):  # pylint: disable=C0103
+        """
+        Serve GET /<kind> and GET /<kind>/history?from=YYYY-MM-DD&to=YYYY-MM-DD
+        :return: None
+        """
+        state = self.server.state
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        kind = parts[0]
+        if kind not in HISTORY_SOURCES or len(parts) > 2 or (len(parts) == 2 and parts[1] != 'history'):
+            self._send_error(404, 'Not found')
+            return
+
+        if len(parts) == 1:
+            data = state.latest.get(kind)
+            if data is None:
+                self._send_error(503, 'No data yet')
+            else:
+                self._send(200, data)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            from_date = pendulum.parse(query['from'][0]) if 'from' in query else None
+            to_date = pendulum.parse(query['to'][0]) if 'to' in query else None
+        except ValueError as e:
+            self._send_error(400, 'Invalid date: {}'.format(e))
+            return
+        # Durations and times are valid ISO 8601 too
+        if not all(date is None or isinstance(date, pendulum.DateTime) for date in (from_date, to_date)):
+            self._send_error(400, 'Invalid date, use YYYY-MM-DD or ISO 8601 date and time')
+            return
+        self._send(200, json.dumps(state.history[kind].between(from_date, to_date)).encode('utf-8'))
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """
+        Log requests with debug level instead of printing them to stderr
+        :param format: Format string
+        :param args: Format arguments
+        :return: None
+        """
+        log.debug(format, *args)
+
+
+def main():
+    """
+    Load cached data, start background refresh and serve requests
+    :return:
+    """
+    args = parse_args()
+    myt = Myt()
+    state = VehicleState()
+    state.load_cache()
+
+    stop = threading.Event()
+    refresher = threading.Thread(target=refresh_loop, args=(state, myt, args.interval, stop), daemon=True)
+    refresher.start()
+
+    server = ThreadingHTTPServer((args.address, args.port), RequestHandler)
+    server.state = state
+    log.info('Serving on http://%s:%s/', args.address, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
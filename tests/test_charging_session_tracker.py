@@ -0,0 +1,145 @@
+"""
+Tests for ChargingSessionTracker
+"""
+import tempfile
+from pathlib import Path
+import unittest
+
+import pendulum
+
+from tojota import NOT_CHARGING_TIME, ChargingSessionTracker
+
+
+def remote_control(timestamp, charging_status, battery_level, remaining_charge_time=120):
+    return {
+        'lastUpdateTimestamp': timestamp,
+        'chargingStatus': charging_status,
+        'batteryLevel': battery_level,
+        'remainingChargeTime': remaining_charge_time,
+    }
+
+
+def telemetry(timestamp, charging_status, battery_level):
+    return {'timestamp': timestamp, 'charging_status': charging_status, 'ev_percentage': battery_level}
+
+
+class ChargingSessionTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state_file = Path(self.temp_dir.name) / 'charging_sessions.json'
+        self.tracker = ChargingSessionTracker(battery_capacity=10, state_file=self.state_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_session_from_charging_to_unplug(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:00:00Z', 'charging', 20))
+        self.tracker.process_remote_control(remote_control('2024-03-01T21:00:00Z', 'charging', 60))
+        self.tracker.process_remote_control(remote_control('2024-03-01T22:00:00Z', 'chargeComplete', 100, 0))
+        self.tracker.process_remote_control(remote_control('2024-03-01T23:00:00Z', 'chargeComplete', 100, 0))
+        session = self.tracker.process_remote_control(remote_control('2024-03-02T07:00:00Z', 'none', 100, 0))
+
+        self.assertEqual(session['start'], '2024-03-01T20:00:00Z')
+        self.assertEqual(session['end'], '2024-03-01T23:00:00Z')
+        self.assertEqual(session['start_level'], 20)
+        self.assertEqual(session['end_level'], 100)
+        self.assertEqual(session['energy'], 8.0)
+        self.assertEqual(session['idle_on_plug'], 3600)
+        self.assertIsNone(self.tracker.current)
+
+    def test_full_battery_on_charge_complete(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:00:00Z', 'charging', 20))
+        self.tracker.process_remote_control(remote_control('2024-03-01T23:00:00Z', 'chargeComplete', 100, 0))
+        session = self.tracker.process_remote_control(remote_control('2024-03-02T07:00:00Z', 'none', 100, 0))
+        self.assertEqual(session['end_level'], 100)
+        self.assertEqual(session['energy'], 8.0)
+        self.assertEqual(session['idle_on_plug'], 0)
+
+    def test_level_drop_ends_session(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:00:00Z', 'charging', 20))
+        self.tracker.process_remote_control(remote_control('2024-03-01T21:00:00Z', 'charging', 60))
+        session = self.tracker.process_telemetry(telemetry('2024-03-02T08:00:00Z', 'none', 55))
+        self.assertEqual(session['end_level'], 60)
+
+    def test_not_charging_sentinel_does_not_start_session(self):
+        self.tracker.process_remote_control(
+            remote_control('2024-03-01T20:00:00Z', 'charging', 80, NOT_CHARGING_TIME))
+        self.assertIsNone(self.tracker.current)
+
+    def test_not_charging_sentinel_counts_as_idle(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:00:00Z', 'charging', 70))
+        self.tracker.process_remote_control(remote_control('2024-03-01T21:00:00Z', 'charging', 80))
+        self.tracker.process_remote_control(
+            remote_control('2024-03-01T22:00:00Z', 'charging', 80, NOT_CHARGING_TIME))
+        session = self.tracker.process_remote_control(remote_control('2024-03-01T23:00:00Z', 'none', 80))
+        self.assertEqual(session['idle_on_plug'], 3600)
+
+    def test_telemetry_does_not_start_session(self):
+        self.tracker.process_telemetry(telemetry('2024-03-01T10:05:00Z', 'charging', 80))
+        self.tracker.process_remote_control(
+            remote_control('2024-03-01T10:00:00Z', 'charging', 80, NOT_CHARGING_TIME))
+        self.assertIsNone(self.tracker.current)
+
+    def test_telemetry_level_rise_extends_charging(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:00:00Z', 'charging', 70))
+        self.tracker.process_telemetry(telemetry('2024-03-01T21:00:00Z', 'charging', 80))
+        self.tracker.process_telemetry(telemetry('2024-03-01T21:30:00Z', 'charging', 80))
+        session = self.tracker.process_remote_control(remote_control('2024-03-01T22:00:00Z', 'none', 80))
+        self.assertEqual(session['end'], '2024-03-01T21:30:00Z')
+        self.assertEqual(session['end_level'], 80)
+        self.assertEqual(session['idle_on_plug'], 1800)
+
+    def test_telemetry_only_session(self):
+        self.tracker.process_telemetry(telemetry('2024-03-01T20:00:00Z', 'charging', 50))
+        self.tracker.process_telemetry(telemetry('2024-03-01T21:00:00Z', 'charging', 60))
+        self.tracker.process_telemetry(telemetry('2024-03-01T22:00:00Z', 'chargeComplete', 80))
+        session = self.tracker.process_telemetry(telemetry('2024-03-02T07:00:00Z', 'none', 80))
+        self.assertEqual(session['start'], '2024-03-01T20:00:00Z')
+        self.assertEqual(session['start_level'], 50)
+        self.assertEqual(session['end_level'], 80)
+        self.assertEqual(session['energy'], 3.0)
+
+    def test_telemetry_plugged_without_rise_does_not_start_session(self):
+        self.tracker.process_telemetry(telemetry('2024-03-01T20:00:00Z', 'charging', 80))
+        self.tracker.process_telemetry(telemetry('2024-03-01T21:00:00Z', 'charging', 80))
+        self.assertIsNone(self.tracker.current)
+
+    def test_late_telemetry_does_not_end_session(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:00:00Z', 'charging', 70))
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:30:00Z', 'charging', 75))
+        self.tracker.process_telemetry(telemetry('2024-03-01T20:10:00Z', 'charging', 72))
+        self.assertIsNotNone(self.tracker.current)
+
+    def test_subsecond_timestamps(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T10:00:00Z', 'charging', 70))
+        self.tracker.process_remote_control(remote_control('2024-03-01T10:00:00.500Z', 'charging', 71))
+        self.assertEqual(self.tracker.current['end_level'], 71)
+
+    def test_older_snapshot_ignored(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T10:00:00.500Z', 'charging', 71))
+        self.tracker.process_remote_control(remote_control('2024-03-01T10:00:00Z', 'none', 70))
+        self.assertIsNotNone(self.tracker.current)
+
+    def test_get_sessions(self):
+        for start in ('2024-02-28T00:00:00Z', '2024-03-01T00:00:00Z', '2024-03-01T02:00:00.500Z'):
+            self.tracker.process_remote_control(remote_control(start, 'charging', 50))
+            self.tracker.process_remote_control(
+                remote_control(pendulum.parse(start).add(hours=1).to_iso8601_string(), 'none', 60))
+        sessions = self.tracker.get_sessions(pendulum.datetime(2024, 3, 1), pendulum.datetime(2024, 4, 1))
+        self.assertEqual([session['start'] for session in sessions],
+                         ['2024-03-01T00:00:00Z', '2024-03-01T02:00:00.500000Z'])
+
+    def test_state_is_saved(self):
+        self.tracker.process_remote_control(remote_control('2024-03-01T20:00:00Z', 'charging', 20))
+        self.tracker.process_remote_control(remote_control('2024-03-01T21:00:00Z', 'none', 40))
+        self.tracker.process_remote_control(remote_control('2024-03-02T20:00:00Z', 'charging', 30))
+        self.tracker.save()
+
+        tracker = ChargingSessionTracker(battery_capacity=10, state_file=self.state_file)
+        self.assertEqual(tracker.sessions, self.tracker.sessions)
+        self.assertEqual(tracker.current, self.tracker.current)
+        self.assertIsNone(tracker.process_remote_control(remote_control('2024-03-02T20:00:00Z', 'none', 30)))
+
+
+if __name__ == '__main__':
+    unittest.main()
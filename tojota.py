@@ -14,13 +14,17 @@
 """
 MyT interaction library
 """
+from email.utils import parsedate_to_datetime
 import glob
 import json
 import logging
 import os
 from pathlib import Path
 import platform
+import random
 import sys
+import threading
+import time
 from urllib.parse import parse_qs, urlparse
 
 import jwt
@@ -34,9 +38,148 @@ log.setLevel(logging.DEBUG)
 CACHE_DIR = 'cache'
 USER_DATA = 'user_data.json'
 INFLUXDB_URL = 'http://localhost:8086/write?db=tojota'
+INFLUXDB_SPOOL = 'influxdb_spool'
+INFLUXDB_BATCH_SIZE = 5000
 
 MYT_API_URL = 'https://ctpa-oneapi.tceu-ctp-prd.toyotaconnectedeurope.io'
 
+REQUEST_RATE = 0.5  # Sustained requests per second per host
+REQUEST_BURST = 5  # Requests per host that can be sent without waiting
+REQUEST_RETRIES = 3  # Retries for network errors, 429 and 5xx responses
+REQUEST_BACKOFF = 2  # Initial backoff in seconds, doubled after each retry
+REQUEST_MAX_RETRY_AFTER = 120  # Give up instead of waiting if server asks to wait longer than this
+REQUEST_TIMEOUT = 30
+CIRCUIT_FAILURES = 3  # Failed requests in a row before endpoint circuit opens
+CIRCUIT_COOLDOWN = 300  # Seconds before a request is allowed to an open circuit again
+CIRCUIT_BREAKERS = 'circuit_breakers.json'
+
+CHARGING_SESSIONS = 'charging_sessions.json'
+BATTERY_CAPACITY = 13.6  # Default usable traction battery capacity in kWh, override with "battery_capacity" in config
+NOT_CHARGING_TIME = 65535  # remainingChargeTime when pulling power from the plug but not really charging
+UNPLUGGED_STATUSES = ('none', 'disconnected')
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter
+    """
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Tokens added per second
+        :param capacity: Max tokens in the bucket
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take a token, wait until one is available
+        :return: None
+        """
+        with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                time.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def block(self, seconds):
+        """
+        Empty the bucket so that next token is available after given seconds. Used for Retry-After.
+        :param seconds: Seconds to wait
+        :return: None
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to an endpoint after repeated failures. After cooldown a single trial request is let through,
+    success closes the circuit and failure keeps it open for another cooldown.
+    """
+    def __init__(self, failures=0, opened=None, max_failures=CIRCUIT_FAILURES, cooldown=CIRCUIT_COOLDOWN):
+        """
+        :param failures: Failed requests in a row
+        :param opened: Unix timestamp when circuit was opened or None if closed
+        :param max_failures: Failed requests in a row before circuit opens
+        :param cooldown: Seconds before a trial request is let through
+        """
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = failures
+        self.opened = opened
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check if request can be sent. After cooldown only one trial request is allowed until it succeeds or fails.
+        :return: True if request can be sent
+        """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.trial or time.time() - self.opened < self.cooldown:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        """
+        Close the circuit
+        :return: None
+        """
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        """
+        Count a failed request and open the circuit if there has been too many of them
+        :return: None
+        """
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.max_failures:
+                self.opened = time.time()
+
+    def to_dict(self):
+        """
+        :return: dict of state to be saved
+        """
+        return {'failures': self.failures, 'opened': self.opened}
+
+
+def _retry_after(response):
+    """
+    Parse Retry-After header, either seconds or HTTP date
+    :param response: requests.Response
+    :return: Seconds to wait or None if header is missing or malformed
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, (parsedate_to_datetime(value) - pendulum.now()).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
 
 class Myt:
     """
@@ -47,6 +190,8 @@ class Myt:
         Create cache directory, try to load existing user data or if it doesn't exist do login.
         """
         os.makedirs(CACHE_DIR, exist_ok=True)
+        self.rate_limiters = {}
+        self.circuit_breakers = self._get_circuit_breakers()
         self.config_data = self._get_config()
         self.user_data = self._get_user_data()
         if not self.user_data or pendulum.now() > pendulum.parse(self.user_data['expiration']):
@@ -93,6 +238,31 @@ class Myt:
         except FileNotFoundError:
             return []
 
+    @staticmethod
+    def _get_circuit_breakers():
+        """
+        Load circuit breaker states saved to CACHE_DIR so that failing endpoints stay blocked between runs
+        :return: dict of endpoint: CircuitBreaker
+        """
+        try:
+            with open(Path(CACHE_DIR) / CIRCUIT_BREAKERS, encoding='utf-8') as f:
+                states = json.load(f)
+            return {endpoint: CircuitBreaker(**state) for endpoint, state in states.items()}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError, AttributeError) as e:
+            log.error('Failed to load circuit breaker states! %s', str(e))
+            return {}
+
+    def _save_circuit_breakers(self):
+        """
+        Save circuit breaker states to CACHE_DIR
+        :return: None
+        """
+        states = {endpoint: breaker.to_dict() for endpoint, breaker in self.circuit_breakers.items()
+                  if breaker.failures}
+        self._write_file(Path(CACHE_DIR) / CIRCUIT_BREAKERS, json.dumps(states))
+
     @staticmethod
     def _read_file(file_path):
         """
@@ -131,6 +301,65 @@ class Myt:
             return max(files, key=os.path.getctime)
         return None
 
+    def _request(self, method, url, **kwargs):
+        """
+        Send request using per host rate limit and per endpoint circuit breaker. Network errors, 429 and 5xx responses
+        are retried with jittered exponential backoff or after Retry-After if server sent it.
+        :param method: HTTP method
+        :param url: Request URL
+        :param kwargs: Arguments for requests.request()
+        :return: requests.Response, last failed response if retries were exhausted
+        """
+        parsed_url = urlparse(url)
+        endpoint = f'{method} {parsed_url.netloc}{parsed_url.path}'
+        rate_limiter = self.rate_limiters.setdefault(parsed_url.netloc, TokenBucket(REQUEST_RATE, REQUEST_BURST))
+        circuit_breaker = self.circuit_breakers.setdefault(endpoint, CircuitBreaker())
+        if not circuit_breaker.allow():
+            raise ValueError('Too many failed requests to {}, not trying again yet'.format(endpoint))
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+
+        for attempt in range(REQUEST_RETRIES + 1):
+            rate_limiter.acquire()
+            try:
+                r = requests.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                r = None
+                error = str(e)
+                retry_after = None
+            else:
+                if r.status_code != 429 and r.status_code < 500:
+                    if circuit_breaker.failures:
+                        circuit_breaker.success()
+                        self._save_circuit_breakers()
+                    return r
+                error = 'Status: {}'.format(r.status_code)
+                retry_after = _retry_after(r)
+            if attempt == REQUEST_RETRIES:
+                break
+            if retry_after is not None:
+                if retry_after > REQUEST_MAX_RETRY_AFTER:
+                    log.warning('%s asked to retry after %s seconds, giving up', endpoint, retry_after)
+                    break
+                rate_limiter.block(retry_after)
+            else:
+                time.sleep(random.uniform(0, REQUEST_BACKOFF * 2 ** attempt))
+            log.warning('Request to %s failed (%s), retry %s/%s', endpoint, error, attempt + 1, REQUEST_RETRIES)
+
+        circuit_breaker.failure()
+        self._save_circuit_breakers()
+        if r is None:
+            raise ValueError('Failed to get data from {}: {}'.format(endpoint, error))
+        return r
+
+    def refresh_login(self):
+        """
+        Login again if access token has expired and update request headers. Needed by long running processes.
+        :return: None
+        """
+        if pendulum.now() > pendulum.parse(self.user_data['expiration']):
+            self.login()
+            self.headers['Authorization'] = f'Bearer {self.user_data["access_token"]}'
+
     def login(self):
         """
         Do Toyota SSO login. Saves user data for configured account in self.user_data
@@ -226,8 +455,8 @@ class Myt:
             to_date = pendulum.now().to_date_string()
         if not from_date:
             from_date = pendulum.now().add(weeks=-1).to_date_string()
-        r = requests.get(
-            f'{MYT_API_URL}/v1/trips?from={from_date}&to={to_date}&route={route}&summary={summary}&limit={limit}&offset={offset}',
+        r = self._request(
+            'GET', f'{MYT_API_URL}/v1/trips?from={from_date}&to={to_date}&route={route}&summary={summary}&limit={limit}&offset={offset}',
             headers=self.headers)
         if r.status_code != 200:
             raise ValueError('Failed to get data, Status: {} Headers: {} Body: {}'.format(r.status_code, r.headers,
@@ -280,7 +509,7 @@ class Myt:
         parking_path = Path(CACHE_DIR) / 'parking'
         parking_file = parking_path / 'parking-{}'.format(pendulum.now())
         url = f'{MYT_API_URL}/v1/location'
-        r = requests.get(url, headers=self.headers)
+        r = self._request('GET', url, headers=self.headers)
         if r.status_code != 200:
             raise ValueError('Failed to get data {} {} {}'.format(r.text, r.status_code, r.headers))
         os.makedirs(parking_path, exist_ok=True)
@@ -300,7 +529,7 @@ class Myt:
         odometer_path = Path(CACHE_DIR) / 'odometer'
         odometer_file = odometer_path / 'odometer-{}'.format(pendulum.now())
         url = f'{MYT_API_URL}/v3/telemetry'
-        r = requests.get(url, headers=self.headers)
+        r = self._request('GET', url, headers=self.headers)
 
         if r.status_code != 200:
             raise ValueError('Failed to get data {} {} {}'.format(r.text, r.status_code, r.headers))
@@ -309,16 +538,7 @@ class Myt:
         if r.text != previous_odometer:
             self._write_file(odometer_file, r.text)
             fresh = True
-        data = r.json()['payload']
-        telemetry = {
-            'odometer': data['odometer']['value'],
-            'hv_percentage': data['fuelLevel'],
-            'hv_range': data['distanceToEmpty']['value'],
-            'ev_percentage': data['batteryLevel'],
-            'timestamp': data['timestamp'],
-            'charging_status': data['chargingStatus'],
-        }
-        return telemetry, fresh
+        return parse_telemetry(r.json()['payload']), fresh
 
     def get_remote_control_status(self):
         """
@@ -330,7 +550,7 @@ class Myt:
         remote_control_path = Path(CACHE_DIR) / 'remote_control'
         remote_control_file = remote_control_path / 'remote_control-{}'.format(pendulum.now())
         url = f'{MYT_API_URL}/v1/global/remote/electric/status'
-        r = requests.get(url, headers=self.headers)
+        r = self._request('GET', url, headers=self.headers)
         if r.status_code != 200:
             raise ValueError('Failed to get data {} {} {}'.format(r.text, r.status_code, r.headers))
         data = r.json()
@@ -370,7 +590,7 @@ class Myt:
                    'X-TME-LOCALE': locale}
         url = 'https://myt-agg.toyota-europe.com/cma/api/v2/trips/summarize'
         params = {'from': date_from, 'calendarInterval': interval}
-        r = requests.get(url, headers=headers, params=params)
+        r = self._request('GET', url, headers=headers, params=params)
         if r.status_code != 200:
             raise ValueError('Failed to get data {} {} {}'.format(r.text, r.status_code, r.headers))
         data = r.json()
@@ -389,16 +609,310 @@ class Myt:
         return data, fresh
 
 
-def insert_into_influxdb(measurement, value):
+def parse_telemetry(data):
+    """
+    Pick interesting values from telemetry payload
+    :param data: telemetry payload dict
+    :return: dict(odometer, hv_percentage, hv_range, ev_percentage, timestamp, charging_status)
+    """
+    return {
+        'odometer': data['odometer']['value'],
+        'hv_percentage': data['fuelLevel'],
+        'hv_range': data['distanceToEmpty']['value'],
+        'ev_percentage': data['batteryLevel'],
+        'timestamp': data['timestamp'],
+        'charging_status': data['chargingStatus'],
+    }
+
+
+class ChargingSessionTracker:
     """
-    Insert data into influxdb (without authentication)
+    Build charging sessions incrementally from remote control status and telemetry snapshots. Session starts when
+    remote control status shows the vehicle charging, or when battery level has risen since the previous snapshot from
+    the same source while plugged in. Telemetry has no remainingChargeTime to tell real charging from idling on plug, so
+    it needs the rise. Session ends when vehicle is unplugged or battery level drops. End level is the highest level
+    seen during the session and charging is considered to end at the last level rise or real charging snapshot. State is
+    saved to CACHE_DIR/charging_sessions.json so that sessions don't have to be rebuilt from snapshots.
+    """
+    REMOTE_CONTROL = 'remote_control'
+    TELEMETRY = 'telemetry'
+
+    def __init__(self, battery_capacity=BATTERY_CAPACITY, state_file=None):
+        """
+        Load saved state if it exists
+        :param battery_capacity: Usable battery capacity in kWh for energy estimation
+        :param state_file: Path for state file, default CACHE_DIR/charging_sessions.json
+        """
+        self.battery_capacity = battery_capacity
+        self.state_file = state_file or Path(CACHE_DIR) / CHARGING_SESSIONS
+        self.last_timestamps = {}
+        self.last_levels = {}
+        self.current = None
+        self.sessions = []
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                state = json.load(f)
+            self.last_timestamps = state['last_timestamps']
+            self.last_levels = state.get('last_levels', {})
+            self.current = state['current']
+            self.sessions = state['sessions']
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            log.error('Failed to load charging sessions, starting from scratch! %s', str(e))
+
+    def save(self):
+        """
+        Save state to state file
+        :return: None
+        """
+        os.makedirs(Path(self.state_file).parent, exist_ok=True)
+        temp_file = Path(self.state_file).with_suffix('.tmp')
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'last_timestamps': self.last_timestamps, 'last_levels': self.last_levels, 'current': self.current,
+                       'sessions': self.sessions}, f)
+        os.replace(temp_file, self.state_file)
+
+    def process(self, timestamp, charging_status, battery_level, remaining_charge_time=None, source=REMOTE_CONTROL):
+        """
+        Process a single snapshot. Snapshots older than previously processed one from the same source are ignored.
+        :param timestamp: Snapshot ISO 8601 timestamp
+        :param charging_status: chargingStatus value
+        :param battery_level: batteryLevel value
+        :param remaining_charge_time: remainingChargeTime value if known
+        :param source: ChargingSessionTracker.REMOTE_CONTROL or ChargingSessionTracker.TELEMETRY
+        :return: Finished session dict or None
+        """
+        if battery_level is None:
+            return None
+        timestamp = pendulum.parse(timestamp).in_tz('UTC')
+        last_timestamp = self.last_timestamps.get(source)
+        if last_timestamp is not None and timestamp.timestamp() <= last_timestamp:
+            return None
+        last_level = self.last_levels.get(source)
+        self.last_timestamps[source] = timestamp.timestamp()
+        self.last_levels[source] = battery_level
+
+        plugged = charging_status not in UNPLUGGED_STATUSES
+        charging = (source == self.REMOTE_CONTROL and charging_status == 'charging'
+                    and remaining_charge_time != NOT_CHARGING_TIME)
+        current = self.current
+        if current:
+            # Snapshots from before latest charging may come late from the other source, they can't end the session
+            if timestamp <= pendulum.parse(current['charge_end']):
+                return None
+            if not plugged or battery_level < current['end_level']:
+                return self._finish()
+            if charging or battery_level > current['end_level']:
+                current['charge_end'] = timestamp.to_iso8601_string()
+                current['end_level'] = battery_level
+            if timestamp > pendulum.parse(current['last_seen']):
+                current['last_seen'] = timestamp.to_iso8601_string()
+            return None
+
+        if charging:
+            start, start_level = timestamp, battery_level
+        elif plugged and last_level is not None and battery_level > last_level:
+            # Charging started sometime after the previous snapshot
+            start, start_level = pendulum.from_timestamp(last_timestamp), last_level
+        else:
+            return None
+        if self.sessions and start <= pendulum.parse(self.sessions[-1]['end']):
+            return None
+        self.current = {
+            'start': start.to_iso8601_string(),
+            'charge_end': timestamp.to_iso8601_string(),
+            'last_seen': timestamp.to_iso8601_string(),
+            'start_level': start_level,
+            'end_level': battery_level,
+        }
+        return None
+
+    def process_remote_control(self, data):
+        """
+        Process remote control status payload from Myt.get_remote_control_status()
+        :param data: status['payload'] dict
+        :return: Finished session dict or None
+        """
+        return self.process(data['lastUpdateTimestamp'], data['chargingStatus'], data['batteryLevel'],
+                            data.get('remainingChargeTime'), self.REMOTE_CONTROL)
+
+    def process_telemetry(self, telemetry):
+        """
+        Process telemetry dict from Myt.get_telemetry()
+        :param telemetry: telemetry dict
+        :return: Finished session dict or None
+        """
+        return self.process(telemetry['timestamp'], telemetry['charging_status'], telemetry['ev_percentage'],
+                            source=self.TELEMETRY)
+
+    def _finish(self):
+        """
+        Move current session to finished sessions
+        :return: Finished session dict
+        """
+        current = self.current
+        session = {
+            'start': current['start'],
+            'end': current['last_seen'],
+            'start_level': current['start_level'],
+            'end_level': current['end_level'],
+            'energy': round((current['end_level'] - current['start_level']) / 100 * self.battery_capacity, 2),
+            'idle_on_plug': (pendulum.parse(current['last_seen']) - pendulum.parse(current['charge_end'])).in_seconds(),
+        }
+        self.sessions.append(session)
+        self.current = None
+        return session
+
+    def get_sessions(self, from_date=None, to_date=None):
+        """
+        Get finished sessions started within given range
+        :param from_date: pendulum datetime or None
+        :param to_date: pendulum datetime or None, exclusive
+        :return: list of session dicts
+        """
+        sessions = []
+        for session in self.sessions:
+            start = pendulum.parse(session['start'])
+            if (from_date is None or start >= from_date) and (to_date is None or start < to_date):
+                sessions.append(session)
+        return sessions
+
+
+def influxdb_line(measurement, value, timestamp=None):
+    """
+    Format a measurement as InfluxDB line protocol with nanosecond timestamp. Timestamp is always set so that spooled
+    or backfilled points keep their real time.
     :param measurement: Measurement name
     :param value: Measurement value
-    :return: null
+    :param timestamp: ISO 8601 string, unix timestamp in seconds or None for current time
+    :return: line protocol string
+    """
+    if timestamp is None:
+        timestamp = time.time_ns()
+    elif isinstance(timestamp, str):
+        timestamp = pendulum.parse(timestamp)
+        timestamp = timestamp.int_timestamp * 10 ** 9 + timestamp.microsecond * 1000
+    else:
+        timestamp = int(timestamp * 10 ** 9)
+    return '{} value={} {}'.format(measurement, value, timestamp)
+
+
+def _post_into_influxdb(lines):
+    """
+    Post lines into influxdb in a single request.
+    :param lines: list of line protocol strings
+    :return: True if lines were handled, False if writing should be retried later
     """
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    payload = "{} value={}".format(measurement, value)
-    requests.post(INFLUXDB_URL, headers=headers, data=payload)
+    try:
+        r = requests.post(INFLUXDB_URL, headers=headers, data='\n'.join(lines), timeout=30)
+    except requests.RequestException as e:
+        log.warning('Failed to connect to influxdb! %s', str(e))
+        return False
+    if r.status_code == 400:
+        # Malformed points will never succeed, don't keep them in the spool
+        log.error('Influxdb rejected %s points, Status: %s Body: %s', len(lines), r.status_code, r.text)
+        return True
+    if not r.ok:
+        # Missing database, authentication errors and server errors may be fixed later
+        log.warning('Influxdb write failed, Status: %s Body: %s', r.status_code, r.text)
+        return False
+    return True
+
+
+def _spool_influxdb_lines(lines, spool_file=None):
+    """
+    Append lines to CACHE_DIR/influxdb_spool file to be written later by flush_influxdb_spool()
+    :param lines: list of line protocol strings
+    :param spool_file: Path for spool file, default CACHE_DIR/influxdb_spool
+    :return: None
+    """
+    log.info('Spooling %s points for later influxdb write', len(lines))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(spool_file or Path(CACHE_DIR) / INFLUXDB_SPOOL, 'a', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_into_influxdb(lines, batch_size=INFLUXDB_BATCH_SIZE):
+    """
+    Write lines into influxdb in chunks of batch_size. Chunks that fail to be written are spooled.
+    :param lines: list of line protocol strings
+    :param batch_size: Max points per request
+    :return: None
+    """
+    for i in range(0, len(lines), batch_size):
+        batch = lines[i:i + batch_size]
+        if not _post_into_influxdb(batch):
+            _spool_influxdb_lines(batch)
+
+
+def flush_influxdb_spool(batch_size=INFLUXDB_BATCH_SIZE, retries=3, backoff=1):
+    """
+    Replay spooled lines into influxdb in chunks of batch_size. Failing chunk is retried with exponential backoff,
+    lines which couldn't be written are appended back to the spool.
+
+    Spool is renamed to a private CACHE_DIR/influxdb_spool-`pid` file before replaying so that lines appended by
+    other processes meanwhile are kept. Private files left behind by interrupted runs are replayed too.
+    :param batch_size: Max points per request
+    :param retries: Attempts per chunk before giving up
+    :param backoff: Initial delay in seconds between attempts, doubled after each attempt
+    :return: True if spool is empty
+    """
+    spool_file = Path(CACHE_DIR) / INFLUXDB_SPOOL
+    replay_file = Path(CACHE_DIR) / '{}-{}'.format(INFLUXDB_SPOOL, os.getpid())
+    try:
+        os.replace(spool_file, replay_file)
+    except FileNotFoundError:
+        pass
+
+    replay_files = glob.glob(str(Path(CACHE_DIR) / '{}-*'.format(INFLUXDB_SPOOL)))
+    if not replay_files:
+        return True
+    lines = []
+    for file_path in replay_files:
+        try:
+            with open(file_path, encoding='utf-8') as f:
+                lines += [line for line in f.read().splitlines() if line]
+        except FileNotFoundError:
+            # Replayed by another process
+            continue
+
+    written = 0
+    while written < len(lines):
+        batch = lines[written:written + batch_size]
+        for attempt in range(retries):
+            if _post_into_influxdb(batch):
+                break
+            if attempt < retries - 1:
+                time.sleep(backoff * 2 ** attempt)
+        else:
+            break
+        written += len(batch)
+    log.info('Flushed %s/%s spooled points into influxdb', written, len(lines))
+
+    remaining = lines[written:]
+    if remaining:
+        _spool_influxdb_lines(remaining, spool_file)
+    for file_path in replay_files:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+    return not remaining
+
+
+def insert_into_influxdb(measurement, value, timestamp=None):
+    """
+    Insert data into influxdb (without authentication). If writing fails data is spooled.
+    :param measurement: Measurement name
+    :param value: Measurement value
+    :param timestamp: ISO 8601 string, unix timestamp in seconds or None for current time
+    :return: null
+    """
+    write_into_influxdb([influxdb_line(measurement, value, timestamp)])
 
 
 def remote_control_to_db(myt, fresh, charge_info, hvac_info):
@@ -420,27 +934,67 @@ def remote_control_to_db(myt, fresh, charge_info, hvac_info):
         insert_into_influxdb('temperature_level', hvac_info['Temperaturelevel'])
 
 
+def ev_data_points(data):
+    """
+    Convert remote control status payload to influxdb lines
+    :param data: remote control status payload
+    :return: list of line protocol strings
+    """
+    timestamp = data['lastUpdateTimestamp']
+    return [
+        influxdb_line('charge_level', data['batteryLevel'], timestamp),
+        influxdb_line('ev_range', data['evRangeWithAc']['value'], timestamp),
+        influxdb_line('hv_level', data['fuelLevel'], timestamp),
+        influxdb_line('hv_range', data['fuelRange']['value'], timestamp),
+    ]
+
+
 def ev_data_to_db(myt, fresh, data):
     if fresh and myt.config_data['use_influxdb']:
         log.debug('Saving EV data to influxdb')
-        insert_into_influxdb('charge_level', data['batteryLevel'])
-        insert_into_influxdb('ev_range', data['evRangeWithAc']['value'])
-        insert_into_influxdb('hv_level', data['fuelLevel'])
-        insert_into_influxdb('hv_range', data['fuelRange']['value'])
+        write_into_influxdb(ev_data_points(data))
 
 
-def odometer_to_db(myt, fresh, fuel_percent, odometer):
+def odometer_points(fuel_percent, odometer, timestamp=None):
+    """
+    Convert odometer information to influxdb lines
+    :param fuel_percent: Fuel level
+    :param odometer: Odometer value
+    :param timestamp: Telemetry timestamp
+    :return: list of line protocol strings
+    """
+    return [
+        influxdb_line('odometer', odometer, timestamp),
+        influxdb_line('fuel_level', fuel_percent, timestamp),
+    ]
+
+
+def odometer_to_db(myt, fresh, fuel_percent, odometer, timestamp=None):
     if fresh and myt.config_data['use_influxdb']:
         log.debug('Saving odometer data to influxdb')
-        insert_into_influxdb('odometer', odometer)
-        insert_into_influxdb('fuel_level', fuel_percent)
+        write_into_influxdb(odometer_points(fuel_percent, odometer, timestamp))
+
+
+def trip_points(kms, liters, timestamp=None):
+    """
+    Convert trip information to influxdb lines
+    :param kms: Trip length in kilometers
+    :param liters: Fuel consumed on the trip in liters
+    :param timestamp: Trip end timestamp
+    :return: list of line protocol strings
+    """
+    lines = [
+        influxdb_line('trip_kilometers', kms, timestamp),
+        influxdb_line('trip_liters', liters, timestamp),
+    ]
+    if kms:
+        lines.append(influxdb_line('trip_average_consumption', (liters / kms) * 100, timestamp))
+    return lines
 
 
-def trip_data_to_db(myt, fresh, average_consumption, kms, liters):
+def trip_data_to_db(myt, fresh, kms, liters, timestamp=None):
     if fresh and myt.config_data['use_influxdb']:
-        insert_into_influxdb('trip_kilometers', kms)
-        insert_into_influxdb('trip_liters', liters)
-        insert_into_influxdb('trip_average_consumption', average_consumption)
+        write_into_influxdb(trip_points(kms, liters, timestamp))
 
 
 def print_trip_stats(trip):
@@ -491,6 +1045,10 @@ def main():
     :return:
     """
     myt = Myt()
+    charging_tracker = ChargingSessionTracker(myt.config_data.get('battery_capacity', BATTERY_CAPACITY))
+
+    if myt.config_data['use_influxdb']:
+        flush_influxdb_spool()
 
     log.info('Get parking info...')
     parking, fresh = myt.get_parking()
@@ -509,7 +1067,8 @@ def main():
         print('Odometer {} km, {}% fuel left'.format(telemetry['odometer'], telemetry['hv_percentage']))
         print('EV {}%, status: {} at {}'.format(telemetry['ev_percentage'], telemetry['charging_status'],
                                                 pendulum.parse(telemetry['timestamp']).in_tz(myt.config_data['timezone']).to_datetime_string()))
-        odometer_to_db(myt, fresh, telemetry['hv_percentage'], telemetry['odometer'])
+        odometer_to_db(myt, fresh, telemetry['hv_percentage'], telemetry['odometer'], telemetry['timestamp'])
+        charging_tracker.process_telemetry(telemetry)
     except ValueError:
         print('Didn\'t get odometer information!')
 
@@ -534,8 +1093,15 @@ def main():
         if data['chargingStatus'] == 'charging' and data['remainingChargeTime'] == 65535:
             print('Pulling power from the plug but not really charging')
         ev_data_to_db(myt, fresh, data)
+        charging_tracker.process_remote_control(data)
         # remote_control_to_db(myt, fresh, charge_info, hvac_info)
 
+    charging_tracker.save()
+    if charging_tracker.current:
+        print('Charging session started at {}, battery {}% -> {}%'.format(
+            pendulum.parse(charging_tracker.current['start']).in_tz(myt.config_data['timezone']).to_datetime_string(),
+            charging_tracker.current['start_level'], charging_tracker.current['end_level']))
+
     log.info('Get trips...')
     trips, fresh = myt.get_trips()
     # Get detailed information about trips and calculate cumulative kilometers and fuel liters
@@ -555,7 +1121,7 @@ def main():
         kms += length
         ls += liters
         average_consumption = (liters/length)*100
-        trip_data_to_db(myt, fresh, average_consumption, kms, liters)
+        trip_data_to_db(myt, fresh, length, liters, trip['summary']['endTs'])
         print('{} {} -> {} {}: {} km, {} km/h, {:.2f} l/100 km, {:.2f} l'.
               format(start_time, start_address, end_time, end_address, length,
                      trip['summary']['averageSpeed'], average_consumption, liters))